@@ -6,6 +6,8 @@ Allows the Node.js backend to call the inference service via REST API.
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import os
+import time
+from PIL import Image, ImageOps
 from ultralytics import YOLO
 from dotenv import load_dotenv
 
@@ -19,6 +21,10 @@ CORS(app)
 MODEL = None
 MODEL_PATH = os.getenv("MODEL_PATH", "./models/best.pt")
 
+# Optional detection model for tray mode; grid layout is used when unset
+TRAY_DETECTOR = None
+TRAY_DETECTOR_PATH = os.getenv("TRAY_DETECTOR_MODEL_PATH", "")
+
 def load_model():
     """Load the YOLO model once at startup."""
     global MODEL
@@ -30,6 +36,105 @@ def load_model():
         print(f"✓ Classes: {list(MODEL.names.values())}")
     return MODEL
 
+def load_tray_detector():
+    """Load the optional cone tip detection model used by tray mode."""
+    global TRAY_DETECTOR
+    if TRAY_DETECTOR is None and TRAY_DETECTOR_PATH:
+        if not os.path.exists(TRAY_DETECTOR_PATH):
+            raise FileNotFoundError(f"Tray detector not found at {TRAY_DETECTOR_PATH}")
+        TRAY_DETECTOR = YOLO(TRAY_DETECTOR_PATH)
+        print(f"✓ Tray detector loaded from {TRAY_DETECTOR_PATH}")
+    return TRAY_DETECTOR
+
+def resolve_image_path(image_path):
+    """Resolve an image path sent by the backend against the project root."""
+    print(f"[INFERENCE] Original path: {image_path}")
+
+    # If path is already absolute and exists, use it
+    if os.path.isabs(image_path) and os.path.exists(image_path):
+        print(f"[INFERENCE] Using absolute path: {image_path}")
+    else:
+        # Path is relative or doesn't exist
+        # The backend runs from project root, so we need to go up one level from inference-service
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        project_root = os.path.dirname(script_dir)  # Go up one level to project root
+
+        if os.path.isabs(image_path):
+            # Absolute path but doesn't exist - use as is and let it fail
+            pass
+        else:
+            # Relative path - make it relative to project root
+            image_path = os.path.join(project_root, image_path)
+
+        print(f"[INFERENCE] Resolved path: {image_path}")
+
+    print(f"[INFERENCE] Path exists: {os.path.exists(image_path)}")
+    return image_path
+
+def pad_box(box, padding, width, height):
+    """Grow a box by a fraction of its size, clamped to the image bounds.
+
+    The result is always at least one pixel wide and tall, so it can be cropped.
+    """
+    x1, y1, x2, y2 = box
+    pad_x = (x2 - x1) * padding
+    pad_y = (y2 - y1) * padding
+    x1 = min(width - 1, max(0, int(round(x1 - pad_x))))
+    y1 = min(height - 1, max(0, int(round(y1 - pad_y))))
+    x2 = max(x1 + 1, min(width, int(round(x2 + pad_x))))
+    y2 = max(y1 + 1, min(height, int(round(y2 + pad_y))))
+    return (x1, y1, x2, y2)
+
+def grid_boxes(width, height, rows, cols):
+    """Split the frame into a rows x cols grid, one cell per tray slot."""
+    cell_w = width / cols
+    cell_h = height / rows
+    cones = []
+    for row in range(rows):
+        for col in range(cols):
+            cones.append({
+                "row": row,
+                "col": col,
+                "box": (col * cell_w, row * cell_h, (col + 1) * cell_w, (row + 1) * cell_h)
+            })
+    return cones
+
+def detect_boxes(detector, image, confidence_threshold):
+    """Locate cone tips with the detection model, in row-major reading order."""
+    results = detector.predict(source=image, conf=confidence_threshold, verbose=False)
+    if not results or results[0].boxes is None or len(results[0].boxes) == 0:
+        return []
+
+    boxes = results[0].boxes
+    cones = [
+        {"box": tuple(float(v) for v in xyxy), "detection_confidence": float(conf)}
+        for xyxy, conf in zip(boxes.xyxy.tolist(), boxes.conf.tolist())
+    ]
+
+    # Group boxes into rows: a box starts a new row when its centre sits more than
+    # half a typical cone height below the mean centre of the current row, so
+    # small offsets on a tilted tray cannot add up and merge two rows
+    cones.sort(key=lambda c: (c["box"][1] + c["box"][3]) / 2)
+    heights = sorted(c["box"][3] - c["box"][1] for c in cones)
+    row_gap = heights[len(heights) // 2] / 2
+
+    row = 0
+    row_centers = []
+    for cone in cones:
+        center_y = (cone["box"][1] + cone["box"][3]) / 2
+        if row_centers and center_y - sum(row_centers) / len(row_centers) > row_gap:
+            row += 1
+            row_centers = []
+        cone["row"] = row
+        row_centers.append(center_y)
+
+    cones.sort(key=lambda c: (c["row"], c["box"][0]))
+    next_col = {}
+    for cone in cones:
+        cone["col"] = next_col.get(cone["row"], 0)
+        next_col[cone["row"]] = cone["col"] + 1
+    return cones
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint."""
@@ -64,27 +169,7 @@ def classify():
         default_confidence = float(os.getenv('DEFAULT_CONFIDENCE_THRESHOLD', '0.3'))
         confidence_threshold = data.get('confidence_threshold', default_confidence)
         
-        print(f"[INFERENCE] Original path: {image_path}")
-        
-        # If path is already absolute and exists, use it
-        if os.path.isabs(image_path) and os.path.exists(image_path):
-            print(f"[INFERENCE] Using absolute path: {image_path}")
-        else:
-            # Path is relative or doesn't exist
-            # The backend runs from project root, so we need to go up one level from inference-service
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            project_root = os.path.dirname(script_dir)  # Go up one level to project root
-            
-            if os.path.isabs(image_path):
-                # Absolute path but doesn't exist - use as is and let it fail
-                pass
-            else:
-                # Relative path - make it relative to project root
-                image_path = os.path.join(project_root, image_path)
-            
-            print(f"[INFERENCE] Resolved path: {image_path}")
-        
-        print(f"[INFERENCE] Path exists: {os.path.exists(image_path)}")
+        image_path = resolve_image_path(image_path)
         
         if not os.path.exists(image_path):
             return jsonify({"error": f"Image not found: {image_path}"}), 404
@@ -92,7 +177,6 @@ def classify():
         model = load_model()
         
         # Run inference
-        import time
         start_time = time.time()
         results = model.predict(source=image_path, conf=confidence_threshold, verbose=False)
         end_time = time.time()
@@ -141,6 +225,142 @@ def classify():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/classify-tray', methods=['POST'])
+def classify_tray():
+    """Locate, crop and batch-classify every cone tip in a tray image."""
+    try:
+        data = request.json
+
+        if 'image_path' not in data:
+            return jsonify({"error": "Missing image_path"}), 400
+
+        default_confidence = float(os.getenv('DEFAULT_CONFIDENCE_THRESHOLD', '0.3'))
+        confidence_threshold = data.get('confidence_threshold', default_confidence)
+        try:
+            detection_confidence = float(data.get(
+                'detection_confidence', os.getenv('TRAY_DETECTION_CONFIDENCE', '0.25')))
+            padding = float(data.get('padding', os.getenv('TRAY_CROP_PADDING', '0.05')))
+            grid = data.get('grid') or {}
+            rows = int(grid.get('rows', os.getenv('TRAY_GRID_ROWS', '4')))
+            cols = int(grid.get('cols', os.getenv('TRAY_GRID_COLS', '5')))
+        except (TypeError, ValueError, AttributeError) as e:
+            return jsonify({"error": f"Invalid tray parameters: {e}"}), 400
+
+        # Trimming half of a box from each side would leave nothing to crop
+        if padding <= -0.5:
+            return jsonify({"error": "Padding must be greater than -0.5"}), 400
+
+        # Detection is used when a detector is configured, unless a grid is requested
+        mode = data.get('mode', 'detect' if TRAY_DETECTOR_PATH else 'grid')
+        if mode not in ('detect', 'grid'):
+            return jsonify({"error": f"Invalid mode: {mode} (expected 'detect' or 'grid')"}), 400
+        if mode == 'detect' and not TRAY_DETECTOR_PATH:
+            return jsonify({"error": "Detect mode requires TRAY_DETECTOR_MODEL_PATH to be set"}), 400
+
+        if mode == 'grid' and (rows < 1 or cols < 1):
+            return jsonify({"error": "Grid rows and cols must be positive"}), 400
+
+        image_path = resolve_image_path(data['image_path'])
+
+        if not os.path.exists(image_path):
+            return jsonify({"error": f"Image not found: {image_path}"}), 404
+
+        model = load_model()
+        detector = load_tray_detector() if mode == 'detect' else None
+
+        total_start = time.perf_counter()
+
+        # Stage 1: decode the full frame once, upright as the operator sees it,
+        # so returned rows, cols and boxes match the displayed photo
+        stage_start = time.perf_counter()
+        image = ImageOps.exif_transpose(Image.open(image_path)).convert('RGB')
+        width, height = image.size
+        load_ms = (time.perf_counter() - stage_start) * 1000
+
+        if mode == 'grid' and (rows > height or cols > width):
+            return jsonify({
+                "error": f"Grid {rows}x{cols} is larger than the {width}x{height} image"
+            }), 400
+
+        # Stage 2: locate cone tips
+        stage_start = time.perf_counter()
+        if mode == 'detect':
+            cones = detect_boxes(detector, image, detection_confidence)
+        else:
+            cones = grid_boxes(width, height, rows, cols)
+        locate_ms = (time.perf_counter() - stage_start) * 1000
+
+        # Stage 3: crop every tip from the in-memory frame
+        stage_start = time.perf_counter()
+        crops = []
+        for cone in cones:
+            cone["box"] = pad_box(cone["box"], padding, width, height)
+            crops.append(image.crop(cone["box"]))
+        crop_ms = (time.perf_counter() - stage_start) * 1000
+
+        # Stage 4: classify all crops in a single batched forward pass
+        stage_start = time.perf_counter()
+        results = model.predict(source=crops, conf=confidence_threshold, verbose=False) if crops else []
+        inference_ms = (time.perf_counter() - stage_start) * 1000
+
+        total_ms = (time.perf_counter() - total_start) * 1000
+
+        print(f"[TRAY] Image: {image_path} ({width}x{height}), mode: {mode}")
+        print(f"[TRAY] Cones located: {len(cones)}")
+
+        cone_results = []
+        class_counts = {}
+        for index, (cone, result) in enumerate(zip(cones, results)):
+            entry = {
+                "index": index,
+                "row": cone["row"],
+                "col": cone["col"],
+                "box": {"x1": cone["box"][0], "y1": cone["box"][1],
+                        "x2": cone["box"][2], "y2": cone["box"][3]},
+                "predicted_class": None,
+                "confidence": 0.0,
+                "all_classes": {}
+            }
+            if "detection_confidence" in cone:
+                entry["detection_confidence"] = cone["detection_confidence"]
+
+            if result.probs is not None:
+                predicted_class = model.names[result.probs.top1]
+                entry["predicted_class"] = predicted_class
+                entry["confidence"] = float(result.probs.top1conf.item())
+                entry["all_classes"] = {
+                    model.names[i]: float(prob.item()) for i, prob in enumerate(result.probs.data)
+                }
+                class_counts[predicted_class] = class_counts.get(predicted_class, 0) + 1
+
+            print(f"[TRAY]   #{index} (r{entry['row']}, c{entry['col']}): "
+                  f"{entry['predicted_class']} ({entry['confidence']:.2%})")
+            cone_results.append(entry)
+
+        timing_ms = {
+            "load": round(load_ms, 2),
+            "locate": round(locate_ms, 2),
+            "crop": round(crop_ms, 2),
+            "inference": round(inference_ms, 2),
+            "total": round(total_ms, 2),
+            "per_cone": round(total_ms / len(cones), 2) if cones else 0.0
+        }
+        print(f"[TRAY] Timing (ms): {timing_ms}")
+
+        return jsonify({
+            "mode": mode,
+            "image_size": {"width": width, "height": height},
+            "num_cones": len(cone_results),
+            "cones": cone_results,
+            "class_counts": class_counts,
+            "timing_ms": timing_ms,
+            "inference_time_ms": int(total_ms),
+            "model_version": "best.pt"
+        })
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5001))
     host = os.getenv('HOST', '0.0.0.0')
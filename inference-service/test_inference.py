@@ -26,6 +26,7 @@ def test_inference(model_path='./models/best.pt', image_path=None):
         print("\n⚠ No test image provided")
         print("\nUsage: python test_inference.py <path_to_test_image>")
         print("Example: python test_inference.py ../uploads/test_cone.jpg")
+        print("Tray layout check: python test_inference.py --tray")
         return
     
     if not os.path.exists(image_path):
@@ -124,7 +125,88 @@ def test_inference(model_path='./models/best.pt', image_path=None):
         import traceback
         traceback.print_exc()
 
+def test_tray_layout():
+    """
+    Check the tray mode box helpers without loading any model.
+    """
+    from http_server import grid_boxes, detect_boxes, pad_box
+
+    print("=" * 60)
+    print("Tray Layout Test")
+    print("=" * 60)
+
+    failures = 0
+
+    def check(name, passed, detail=""):
+        nonlocal failures
+        if passed:
+            print(f"  ✓ {name}")
+        else:
+            failures += 1
+            print(f"  ❌ {name} {detail}")
+
+    # Grid boxes must tile the whole frame with no gaps or overlaps
+    print("\n📐 Grid layout (4x5 on a 1003x798 frame)")
+    width, height = 1003, 798
+    cones = grid_boxes(width, height, 4, 5)
+    boxes = [pad_box(c["box"], 0.0, width, height) for c in cones]
+    covered = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in boxes)
+    check("20 cells returned", len(cones) == 20, f"(got {len(cones)})")
+    check("cells cover the whole frame", covered == width * height,
+          f"(covered {covered} of {width * height} pixels)")
+    check("first cell starts at the origin", boxes[0][:2] == (0, 0), f"(got {boxes[0]})")
+    check("last cell ends at the frame corner", boxes[-1][2:] == (width, height),
+          f"(got {boxes[-1]})")
+
+    # Detected boxes come back shuffled from a tilted 2x3 tray
+    print("\n🔍 Detection order (tilted 2x3 tray)")
+
+    class FakeTensor(list):
+        def tolist(self):
+            return list(self)
+
+    class FakeBoxes:
+        xyxy = FakeTensor([
+            [220, 130, 300, 210],  # row 0, col 2
+            [10, 310, 90, 390],    # row 1, col 0
+            [10, 100, 90, 180],    # row 0, col 0
+            [115, 115, 195, 195],  # row 0, col 1
+            [220, 340, 300, 420],  # row 1, col 2
+            [115, 325, 195, 405],  # row 1, col 1
+        ])
+        conf = FakeTensor([0.9] * 6)
+
+        def __len__(self):
+            return len(self.xyxy)
+
+    class FakeResult:
+        boxes = FakeBoxes()
+
+    class FakeDetector:
+        def predict(self, **kwargs):
+            return [FakeResult()]
+
+    cones = detect_boxes(FakeDetector(), None, 0.25)
+    positions = [(c["row"], c["col"]) for c in cones]
+    expected = [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2)]
+    check("rows and cols assigned in row-major order", positions == expected,
+          f"(got {positions})")
+    lefts = [c["box"][0] for c in cones]
+    check("boxes sorted left to right within each row",
+          lefts == [10, 115, 220, 10, 115, 220], f"(got {lefts})")
+
+    print("\n" + "=" * 60)
+    if failures:
+        print(f"❌ {failures} check(s) failed")
+    else:
+        print("✓ Tray Layout Test Complete!")
+    print("=" * 60)
+    return failures == 0
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--tray":
+        sys.exit(0 if test_tray_layout() else 1)
+
     model_path = './models/best.pt'
     image_path = None
     